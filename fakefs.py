@@ -9,223 +9,754 @@ with fs.monkey.patch():
     with open('file.txt') as f:
         print(f.read())
 """
+import builtins
+import collections
+import functools
 import io
+import itertools
 import os
+# Bound at import, so the fake's own path handling skips the os.path lookups
+# and is unaffected by whatever gets patched into os.path while it runs
+from os.path import basename as _basename, join as _join, normpath as _normpath, split as _split
+import shutil
+import stat
+import sys
 import tempfile
-from typing import Callable, Dict, List, Union
-import uuid
+from types import ModuleType
+from typing import Any, Callable, DefaultDict, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-from unittest.mock import patch
+
+def _intern(s: str) -> str:
+    # Interned keys let dict and set lookups match on identity before
+    # comparing characters. Bytes paths cannot be interned.
+    return sys.intern(s) if isinstance(s, str) else s
+
+
+@functools.lru_cache(maxsize=4096)
+def _norm(path: str) -> str:
+    # Tests keep probing the same handful of paths, so normalize each only once
+    return _intern(_normpath(path))
+
+
+@functools.lru_cache(maxsize=4096)
+def _ancestry(path: str) -> Tuple[Tuple[str, str], ...]:
+    """(parent, name) pairs from a normalized path up to its topmost directory"""
+    pairs = []
+    head, tail = _split(path)
+    while tail:
+        pairs.append((_intern(head or os.curdir), _intern(tail)))
+        head, tail = _split(head)
+    return tuple(pairs)
+
+
+def _slice(buffer: bytearray, start: int, end: int) -> bytes:
+    # Through a memoryview the slice is copied once, not twice as with
+    # bytes(buffer[start:end])
+    with memoryview(buffer) as view:
+        return view[start:end].tobytes()
+
+
+def _child(parent: str, name: str) -> str:
+    # Parents are already normalized, so skip the generality of os.path.join
+    if parent == os.curdir:
+        return name
+    if parent.endswith(os.sep):
+        return parent + name
+    return parent + os.sep + name
+
+
+# (module, attribute, FakeFilesystem method replacing it)
+_PATCH_TARGETS = (
+    (builtins, 'open', 'open'),
+
+    (os.path, 'exists', 'exists'),
+    (os.path, 'isfile', 'isfile'),
+    (os.path, 'getsize', 'getsize'),
+    (os.path, 'isdir', 'isdir'),
+
+    (shutil, 'copy', 'copy'),
+    (shutil, 'copyfile', 'copyfile'),
+    (shutil, 'chown', 'chown'),
+    (shutil, 'rmtree', 'rmtree'),
+
+    (os, 'rename', 'rename'),
+    (os, 'mkdir', 'mkdir'),
+    (os, 'makedirs', 'makedirs'),
+    (os, 'remove', 'remove'),
+    (os, 'stat', 'stat'),
+    (os, 'listdir', 'listdir'),
+    (tempfile, 'TemporaryDirectory', 'temporary_directory'),
+)  # type: Tuple[Tuple[ModuleType, str, str], ...]
 
 
 class Monkey(object):
+    __slots__ = ('fs', 'original', 'depth', 'targets')
+
     def __init__(self, fs) -> None:
         self.fs = fs
-        self.original = {}  # type: Dict[str, Callable]
-        self.patches = []  # type: List[patch]
+        self.original = []  # type: List[Any]
+        # Nested start() calls, only the outermost one patches
+        self.depth = 0
+        # Built once per filesystem, starting the patch only swaps attributes.
+        # Module namespaces are plain dicts, storing into them directly skips
+        # the setattr machinery.
+        self.targets = tuple(
+            (vars(module), name, getattr(fs, fake)) for module, name, fake in _PATCH_TARGETS
+        )  # type: Tuple[Tuple[Dict[str, Any], str, Callable], ...]
 
     def patch(self):
         """Patches relevant functions in builtins, os, and shutil"""
-        self.patches.append(patch('builtins.open', self.fs.open))
+        return self
 
-        self.patches.append(patch('os.path.exists', self.fs.exists))
-        self.patches.append(patch('os.path.isfile', self.fs.isfile))
-        self.patches.append(patch('os.path.getsize', self.fs.getsize))
-        self.patches.append(patch('os.path.isdir', self.fs.isdir))
+    def start(self) -> None:
+        """Applies the patch, for use in setUp when a with block does not fit"""
+        # Plain attribute swaps, unittest.mock.patch is far too slow to set up
+        # and tear down for every single test.
+        self.depth += 1
+        if self.depth > 1:
+            # Already patched, saving the fakes as originals would keep them
+            # installed for good
+            return
+        self.original = [namespace[name] for namespace, name, _ in self.targets]
+        for namespace, name, fake in self.targets:
+            namespace[name] = fake
+
+    def stop(self) -> None:
+        """Undoes start()"""
+        if self.depth == 0:
+            return
+        self.depth -= 1
+        if self.depth > 0:
+            return
+        for (namespace, name, _), original in zip(self.targets, self.original):
+            namespace[name] = original
+        self.original = []
 
-        self.patches.append(patch('shutil.copy', self.fs.copy))
-        self.patches.append(patch('shutil.chown', self.fs.chown))
-        self.patches.append(patch('shutil.rmtree', self.fs.rmtree))
+    def __enter__(self):
+        self.start()
 
-        self.patches.append(patch('os.rename', self.fs.rename))
-        self.patches.append(patch('os.mkdir', self.fs.mkdir))
-        self.patches.append(patch('os.makedirs', self.fs.makedirs))
-        self.patches.append(patch('os.remove', self.fs.remove))
-        self.patches.append(patch('os.stat', self.fs.stat))
-        self.patches.append(patch('os.listdir', self.fs.listdir))
-        self.patches.append(patch('tempfile.TemporaryDirectory', FakedTemporaryDirectory))
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
 
-        return self
 
-    def __enter__(self):
-        for p in self.patches:
-            p.start()
+def _encode(text: str) -> bytes:
+    if os.linesep != '\n':
+        # Like io.TextIOWrapper does by default
+        text = text.replace('\n', os.linesep)
+    return text.encode('utf-8')
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        for p in self.patches:
-            p.stop()
 
-class InspectableBytesIO(io.BytesIO):
-    def __init__(self, onclose=None, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
+class InspectableBytesIO(io.RawIOBase):
+    """Write-only in-memory file, handing its content to onclose when closed.
+
+    Writes are kept as a list of chunks and joined once, rather than growing
+    a buffer on every write like io.BytesIO does.
+    """
+    __slots__ = ('onclose', 'chunks', 'size')
+
+    def __init__(self, onclose=None) -> None:
+        super().__init__()
         self.onclose = onclose
+        self.chunks = []  # type: List[bytes]
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._checkClosed()
+        # Through memoryview, so ints and str are rejected like io.BytesIO
+        # does, rather than bytes(3) quietly writing three zero bytes
+        data = memoryview(b).tobytes()
+        self.chunks.append(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        self._checkClosed()
+        return self.size
+
+    def getvalue(self) -> bytes:
+        self._checkClosed()
+        return b''.join(self.chunks)
 
     def close(self) -> None:
-        if self.onclose:
+        if not self.closed and self.onclose:
             self.onclose(self.getvalue())
         super(InspectableBytesIO, self).close()
 
 
-class FakeFile(object):
-    def __init__(self, data: bytes) -> None:
+class InspectableSeekableIO(io.BytesIO):
+    """Readable, writable and seekable in-memory file for the '+' modes,
+    handing its content to onclose when closed."""
+    __slots__ = ('onclose',)
+
+    def __init__(self, onclose=None, initial_bytes: bytes = b'') -> None:
+        super().__init__(initial_bytes)
+        self.onclose = onclose
+
+    def close(self) -> None:
+        if not self.closed and self.onclose:
+            self.onclose(self.getvalue())
+        super(InspectableSeekableIO, self).close()
+
+
+class InspectableAppendingIO(InspectableSeekableIO):
+    """InspectableSeekableIO for 'a+', where every write goes to the end"""
+    __slots__ = ()
+
+    def write(self, b) -> int:
+        self.seek(0, io.SEEK_END)
+        return super(InspectableAppendingIO, self).write(b)
+
+    def writelines(self, lines) -> None:
+        # io.BytesIO.writelines does not go through write()
+        for line in lines:
+            self.write(line)
+
+
+class InspectableStringIO(io.TextIOBase):
+    """Write-only text file, handing its encoded content to onclose when closed.
+
+    Like InspectableBytesIO, but keeps the written strings and encodes them
+    all at once, instead of running each write through io.TextIOWrapper.
+    """
+    __slots__ = ('onclose', 'chunks', 'counted', 'size')
+    encoding = 'utf-8'
+
+    def __init__(self, onclose=None) -> None:
+        super().__init__()
+        self.onclose = onclose
+        self.chunks = []  # type: List[str]
+        # Encoded size of chunks[:counted], kept up to date by tell()
+        self.counted = 0
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        self._checkClosed()
+        if not isinstance(s, str):
+            raise TypeError("write() argument must be str, not {}".format(type(s).__name__))
+        self.chunks.append(s)
+        return len(s)
+
+    def getvalue(self) -> str:
+        self._checkClosed()
+        return ''.join(self.chunks)
+
+    def tell(self) -> int:
+        # Position in bytes like io.TextIOWrapper. Rarely asked for, so only
+        # tell() encodes, and just the chunks written since it last did.
+        self._checkClosed()
+        chunks = self.chunks
+        for i in range(self.counted, len(chunks)):
+            self.size += len(_encode(chunks[i]))
+        self.counted = len(chunks)
+        return self.size
+
+    def close(self) -> None:
+        if not self.closed and self.onclose:
+            self.onclose(_encode(self.getvalue()))
+        super(InspectableStringIO, self).close()
+
+
+class ReadOnlyBytesIO(io.RawIOBase):
+    """Read-only in-memory file over data[start:end].
+
+    io.BytesIO copies its initial bytes up front. Stored data is never
+    overwritten, so this only keeps a reference and copies just the slices
+    being read.
+    """
+    __slots__ = ('data', 'start', 'end', 'pos')
+
+    def __init__(self, data: Union[bytes, bytearray], start: int = 0, end: int = None) -> None:
+        super().__init__()
         self.data = data
+        self.start = start
+        self.end = len(data) if end is None else end
+        self.pos = start
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def _end(self, size: int) -> int:
+        if size is None or size < 0:
+            return self.end
+        return min(self.pos + size, self.end)
+
+    def read(self, size: int = -1) -> bytes:
+        self._checkClosed()
+        data = _slice(self.data, self.pos, self._end(size))
+        self.pos += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readline(self, size: int = -1) -> bytes:
+        self._checkClosed()
+        end = self._end(size)
+        newline = self.data.find(b'\n', self.pos, end)
+        if newline != -1:
+            end = newline + 1
+        return self.read(end - self.pos)
+
+    def tell(self) -> int:
+        self._checkClosed()
+        return self.pos - self.start
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._checkClosed()
+        if whence == io.SEEK_CUR:
+            offset += self.pos - self.start
+        elif whence == io.SEEK_END:
+            offset += self.end - self.start
+        elif whence != io.SEEK_SET:
+            raise ValueError("invalid whence ({}, should be 0, 1 or 2)".format(whence))
+        if offset < 0:
+            raise ValueError("negative seek value {}".format(offset))
+        self.pos = self.start + offset
+        return offset
+
+    def getvalue(self) -> bytes:
+        self._checkClosed()
+        return _slice(self.data, self.start, self.end)
+
+
+class ReadOnlyStringIO(io.TextIOBase):
+    """Read-only text file over data[start:end].
+
+    Decodes the whole content once on first read, rather than setting up the
+    incremental decoder and buffers of io.TextIOWrapper for every open().
+    Newlines are translated like io.TextIOWrapper does by default.
+    """
+    __slots__ = ('data', 'start', 'end', 'text', 'pos')
+    encoding = 'utf-8'
+
+    def __init__(self, data: Union[bytes, bytearray], start: int = 0, end: int = None) -> None:
+        super().__init__()
+        self.data = data
+        self.start = start
+        self.end = len(data) if end is None else end
+        self.text = None  # type: str
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def _decoded(self) -> str:
+        self._checkClosed()
+        if self.text is None:
+            text = _slice(self.data, self.start, self.end).decode('utf-8')
+            if '\r' in text:
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+            self.text = text
+        return self.text
+
+    def read(self, size: int = -1) -> str:
+        text = self._decoded()
+        end = len(text) if size is None or size < 0 else self.pos + size
+        data = text[self.pos:end]
+        self.pos += len(data)
+        return data
+
+    def readline(self, size: int = -1) -> str:
+        text = self._decoded()
+        end = len(text) if size is None or size < 0 else min(self.pos + size, len(text))
+        newline = text.find('\n', self.pos, end)
+        if newline != -1:
+            end = newline + 1
+        return self.read(max(end - self.pos, 0))
+
+    def tell(self) -> int:
+        self._checkClosed()
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        text = self._decoded()
+        if whence != io.SEEK_SET and offset != 0:
+            raise io.UnsupportedOperation("can't do nonzero cur-relative seeks")
+        if whence == io.SEEK_END:
+            offset = len(text)
+        elif whence == io.SEEK_CUR:
+            offset = self.pos
+        elif whence != io.SEEK_SET:
+            raise ValueError("invalid whence ({}, should be 0, 1 or 2)".format(whence))
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+        self.pos = offset
+        return self.pos
+
+
+class FakeFile(object):
+    """Where a file's content is in the filesystem's data arena"""
+    __slots__ = ('offset', 'length', 'stat')
+
+    def __init__(self, offset: int, length: int) -> None:
+        self.offset = offset
+        self.length = length
+        # Built by the first stat() call. Writes replace the FakeFile, so it
+        # never goes stale.
+        self.stat = None  # type: os.stat_result
+
+
+def _file_stat(size: int) -> os.stat_result:
+    # mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime
+    return os.stat_result((stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, size, 0, 0, 0))
 
 
-class FakeStat(object):
-    def __init__(self, path):
-        self.st_mtime = 0
+# All directories look the same
+_DIR_STAT = os.stat_result((stat.S_IFDIR | 0o755, 0, 0, 2, 0, 0, 0, 0, 0, 0))
+
+# Smallest arena worth compacting, below it the dead space is left alone
+_MIN_COMPACT_SIZE = 1 << 20
 
 
 class FakeFilesystem(object):
+    __slots__ = ('files', '_arena', '_compact_at', '_children', '_created_dirs', '_temp_names', 'monkey')
+
     def __init__(self) -> None:
         self.files = {}  # type: Dict[str, FakeFile]
+        # The content of all files, back to back. It is only ever appended to,
+        # so files can share and append to their slices without copying and
+        # open readers never see their data change. Space left behind by
+        # replaced or removed files is reclaimed by _compact().
+        self._arena = bytearray()
+        self._compact_at = _MIN_COMPACT_SIZE
+        # Directory index kept next to files, so directory queries never have
+        # to scan every file path. Its keys are exactly the existing
+        # directories, so isdir is a single lookup too.
+        self._children = collections.defaultdict(set)  # type: DefaultDict[str, Set[str]]
+        # Made with mkdir/makedirs, these are kept even when empty
+        self._created_dirs = set()  # type: Set[str]
+        self._temp_names = itertools.count()  # type: Iterator[int]
         self.monkey = Monkey(self)
 
+    def _store(self, path: str, file: FakeFile) -> None:
+        self.files[path] = file
+        self._add_to_index(path)
+
+    def _write(self, path: str, data: bytes) -> None:
+        offset = len(self._arena)
+        self._arena += data
+        self._store(path, FakeFile(offset, len(data)))
+        if len(self._arena) > self._compact_at:
+            self._compact()
+
+    def _append(self, path: str, data: bytes) -> None:
+        f = self.files.get(path)
+        if f is None:
+            self._write(path, data)
+            return
+
+        arena = self._arena
+        offset = f.offset
+        if offset + f.length != len(arena):
+            # Only the last slice can grow in place, move the file to the end
+            offset = len(arena)
+            arena += arena[f.offset:f.offset + f.length]
+        arena += data
+        self.files[path] = FakeFile(offset, len(arena) - offset)
+        if len(arena) > self._compact_at:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Copies the content of the current files into a new arena"""
+        # A new arena rather than moving data within the old one, files still
+        # open keep reading the old one
+        old, arena = self._arena, bytearray()
+        # Copies share their FakeFile, which must only be moved once: after
+        # that its offset points into the new arena. Distinct FakeFiles over
+        # the same slice keep sharing it.
+        unique = {id(f): f for f in self.files.values()}
+        moved = {}  # type: Dict[Tuple[int, int], int]
+        for f in unique.values():
+            key = (f.offset, f.length)
+            offset = moved.get(key)
+            if offset is None:
+                offset = moved[key] = len(arena)
+                arena += memoryview(old)[f.offset:f.offset + f.length]
+            f.offset = offset
+        self._arena = arena
+        # Only compact again once the arena has doubled, so the copying is
+        # paid for by what was written since
+        self._compact_at = max(2 * len(arena), _MIN_COMPACT_SIZE)
+
+    def _read(self, f: FakeFile) -> bytes:
+        return _slice(self._arena, f.offset, f.offset + f.length)
+
+    def _stat(self, path: str) -> Optional[os.stat_result]:
+        """Cached stat of a normalized path, None if it does not exist"""
+        f = self.files.get(path)
+        if f is None:
+            return _DIR_STAT if path in self._children else None
+        if f.stat is None:
+            f.stat = _file_stat(f.length)
+        return f.stat
+
+    def _temp_dir_name(self) -> str:
+        # Numbered rather than uuid4 named, which would read os.urandom
+        while True:
+            name = _join(tempfile.gettempdir(), 'fake_tmp_{}'.format(next(self._temp_names)))
+            if name not in self.files and name not in self._children:
+                return name
+
+    def _add_to_index(self, path: str) -> None:
+        # Loop invariants in locals, these run once per path level
+        index = self._children
+        for parent, name in _ancestry(path):
+            children = index[parent]
+            if name in children:
+                # Ancestors are already indexed
+                break
+            children.add(name)
+
+    def _remove_from_index(self, path: str) -> None:
+        index = self._children
+        for parent, name in _ancestry(path):
+            children = index.get(parent)
+            if children is None:
+                break
+            children.discard(name)
+            if children or parent in self._created_dirs:
+                break
+            # Implicit directories only exist through their contents
+            del index[parent]
+
     # Setup functions
-    def add_file(self, path: str, data: str) -> None:
-        p = os.path.normpath(path)
-        self.files[p] = FakeFile(data.encode('utf-8'))
+    def reset(self) -> None:
+        """Removes all files and directories, to reuse the filesystem between tests"""
+        self.files.clear()
+        # A new arena rather than clearing it, files still open keep the old one
+        self._arena = bytearray()
+        self._compact_at = _MIN_COMPACT_SIZE
+        self._children.clear()
+        self._created_dirs.clear()
+
+    def add_file(self, path: str, data: Union[str, bytes]) -> None:
+        p = _norm(path)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._write(p, data)
 
     # Assert functions
     def content_for(self, path: str):
-        return self.files[path].data
+        return self._read(self.files[path])
 
     # Fake functions
-    def open(self, path: str, mode: str = 'r') -> Union[io.BytesIO, io.TextIOWrapper]:
-        p = os.path.normpath(path)
-        if mode.startswith('r'):
-            if p in self.files:
-                data = io.BytesIO(self.files[p].data)
-                if 'b' in mode:
-                    return data
-                return io.TextIOWrapper(data)
-
+    def open(self, path: str, mode: str = 'r') -> Union[io.RawIOBase, io.BufferedIOBase, io.TextIOBase]:
+        try:
+            opener, binary = _MODE_DISPATCH[mode]
+        except KeyError:
+            raise ValueError("invalid mode: '{}'".format(mode)) from None
+        return opener(self, path, binary)
+
+    def _open_read(self, path: str, binary: bool) -> Union[io.RawIOBase, io.TextIOBase]:
+        stored = self.files.get(_norm(path))
+        if stored is None:
             raise FileNotFoundError("[Errno 2] No such file or directory: '{}'".format(path))
-
-        if mode.startswith('w'):
-            # Add file
-            def store_file(content):
-                self.files[p] = FakeFile(content)
-
-            f = InspectableBytesIO(store_file)
-            if 'b' in mode:
-                return f
-            return io.TextIOWrapper(f)
-        
-        if mode.startswith('a'):
-            # Add file
-            def append_file(content):
-                if p in self.files:
-                    self.files[p] = FakeFile(self.files[p].data + content)
-                else:
-                    self.files[p] = FakeFile(content)
-
-            f = InspectableBytesIO(append_file)
-            if 'b' in mode:
-                return f
-            return io.TextIOWrapper(f)
-
-        raise ValueError("invalid mode: '{}'".format(mode))
+        end = stored.offset + stored.length
+        if binary:
+            return ReadOnlyBytesIO(self._arena, stored.offset, end)
+        return ReadOnlyStringIO(self._arena, stored.offset, end)
+
+    def _open_write(self, path: str, binary: bool) -> Union[io.RawIOBase, io.TextIOBase]:
+        store_file = _StoreCallback(self, _norm(path))
+        if binary:
+            return InspectableBytesIO(store_file)
+        return InspectableStringIO(store_file)
+
+    def _open_append(self, path: str, binary: bool) -> Union[io.RawIOBase, io.TextIOBase]:
+        # On close the file's slice of the arena grows by what was written
+        store_file = _StoreCallback(self, _norm(path), append=True)
+        if binary:
+            return InspectableBytesIO(store_file)
+        return InspectableStringIO(store_file)
+
+    def _open_read_update(self, path: str, binary: bool) -> Union[io.BufferedIOBase, io.TextIOBase]:
+        p = _norm(path)
+        stored = self.files.get(p)
+        if stored is None:
+            raise FileNotFoundError("[Errno 2] No such file or directory: '{}'".format(path))
+        return self._open_update(p, self._read(stored), binary)
+
+    def _open_write_update(self, path: str, binary: bool) -> Union[io.BufferedIOBase, io.TextIOBase]:
+        return self._open_update(_norm(path), b'', binary)
+
+    def _open_append_update(self, path: str, binary: bool) -> Union[io.BufferedIOBase, io.TextIOBase]:
+        p = _norm(path)
+        stored = self.files.get(p)
+        data = b'' if stored is None else self._read(stored)
+        return self._open_update(p, data, binary, append=True)
+
+    def _open_update(self, path: str, data: bytes, binary: bool,
+                     append: bool = False) -> Union[io.BufferedIOBase, io.TextIOBase]:
+        # The '+' modes are rare, so they get a plain io.BytesIO holding the
+        # whole content, which replaces the file when closed
+        if append:
+            f = InspectableAppendingIO(_StoreCallback(self, path), data)
+            f.seek(0, io.SEEK_END)
+        else:
+            f = InspectableSeekableIO(_StoreCallback(self, path), data)
+        if binary:
+            return f
+        return io.TextIOWrapper(f, encoding='utf-8')
 
     def exists(self, path: str) -> bool:
-        p = os.path.normpath(path)
-        return p in self.files
-
-    def copy(self, source: str, target: str) -> None:
-        s = os.path.normpath(source)
-        t = os.path.normpath(target)
-        if s not in self.files:
+        p = _norm(path)
+        return p in self.files or p in self._children
+
+    def copy(self, source: str, target: str) -> str:
+        t = _norm(target)
+        if t in self._children:
+            target = _child(t, _basename(_norm(source)))
+        return self.copyfile(source, target)
+
+    def copyfile(self, source: str, target: str) -> str:
+        s = _norm(source)
+        t = _norm(target)
+        f = self.files.get(s)
+        if f is None:
             raise IOError("Could not copy '{}' to '{}'".format(s, t))
-        self.files[t] = self.files[s]
+        # Stored content is never overwritten, so the copy can share it
+        self._store(t, f)
+        return target
 
     def chown(self, path: str, user: str, group: str = None):
-        p = os.path.normpath(path)
+        p = _norm(path)
         if p not in self.files:
             raise FileNotFoundError("[Errno 2] No such file or directory: '{}'".format(path))
 
     def rmtree(self, path):
-        p = os.path.normpath(path)
-        self.files = {key: value for key, value in self.files.items() if not key.startswith(p)}
+        p = _norm(path)
+        files, index, created_dirs = self.files, self._children, self._created_dirs
+        pending = [p]
+        while pending:
+            d = pending.pop()
+            files.pop(d, None)
+            created_dirs.discard(d)
+            pending.extend(_child(d, name) for name in index.pop(d, ()))
+        self._remove_from_index(p)
 
     def rename(self, source: str, target: str) -> None:
-        s = os.path.normpath(source)
-        t = os.path.normpath(target)
-        if s not in self.files:
+        s = _norm(source)
+        t = _norm(target)
+        f = self.files.pop(s, None)
+        if f is None:
             raise FileNotFoundError("[Errno 2] No such file or directory: '{}' -> '{}'".format(source, target))
 
-        self.files[t] = self.files.pop(s)
+        # Unindex first, renaming a file onto itself must leave it indexed
+        self._remove_from_index(s)
+        self._store(t, f)
 
-    def mkdir(self, path: str, mode: int = 0o777) -> None:
-       self.makedirs(path, mode)
- 
-    def makedirs(self, path: str, mode: int = 0o777, exists_ok: bool = False) -> None:
-        # TODO(niko or samuel): Proper directory support
-        # Only files exists in the fake fs
-        p = os.path.normpath(path)
-        # Create empty marker file in directory
-        self.files[os.path.join(p, '..mark')] = FakeFile(b'')
+    def makedirs(self, path: str, mode: int = 0o777, exist_ok: bool = False) -> None:
+        p = _norm(path)
+        if p in self._created_dirs:
+            return
+        self._created_dirs.add(p)
+        # Like os.makedirs, the missing parents are made too, and are kept
+        # when emptied just the same
+        self._created_dirs.update(parent for parent, _ in _ancestry(p))
+        # Registers the directory, even while empty
+        self._children.setdefault(p, set())
+        self._add_to_index(p)
+
+    mkdir = makedirs
 
     def isfile(self, path):
-        p = os.path.normpath(path)
+        p = _norm(path)
         return p in self.files
 
     def getsize(self, path):
-        p = os.path.normpath(path)
-        if p not in self.files:
+        st = self._stat(_norm(path))
+        if st is None:
             raise FileNotFoundError("[Errno 2] No such file or directory: '{}'".format(path))
-        return len(self.files[p].data)
+        return st.st_size
 
     def isdir(self, path):
-        # TODO(niko or samuel): Proper directory support
-        p = os.path.normpath(path)
-        if p in self.files:
-            return False
-        return any(file.startswith(p) for file in self.files.keys())
+        p = _norm(path)
+        return p in self._children
 
     def remove(self, path):
-        p = os.path.normpath(path)
-        if p not in self.files:
+        p = _norm(path)
+        if self.files.pop(p, None) is None:
             raise FileNotFoundError("[Errno 2] No such file or directory: '{}'".format(path))
-        del self.files[p]
+        self._remove_from_index(p)
 
     def stat(self, path):
-        p = os.path.normpath(path)
-        if p not in self.files:
+        st = self._stat(_norm(path))
+        if st is None:
             raise FileNotFoundError("[Errno 2] No such file or directory: '{}'".format(path))
-        return FakeStat(p)
+        return st
 
-    def listdir(self, path):
-        def first_segment(subpath):
-            dirname, basename = os.path.split(subpath)
-            if not dirname or dirname == '/':
-                return basename
-            return first_segment(dirname)
+    def temporary_directory(self) -> 'FakedTemporaryDirectory':
+        return FakedTemporaryDirectory(self)
 
+    def listdir(self, path):
         # listdir also supports passing a file descriptor to directory
         if isinstance(path, int):
             return []
 
-        p = os.path.normpath(path)
+        p = _norm(path)
 
-        if not self.isdir(p):
+        if p not in self._children:
             raise FileNotFoundError("[Errno 2] No such file or directory: '{}'".format(path))
 
-        # Handle files
-        suffixes = [f[len(p):] for f in self.files.keys() if f.startswith(p)]
-        return [first_segment(suff) for suff in suffixes if not suff.endswith('..mark')]
+        return sorted(self._children[p])
+
+
+# open() mode -> (opener, binary), one lookup instead of parsing the mode
+_MODE_DISPATCH = {
+    kind + flags: (update_opener if '+' in flags else opener, 'b' in flags)
+    for kind, opener, update_opener in (
+        ('r', FakeFilesystem._open_read, FakeFilesystem._open_read_update),
+        ('w', FakeFilesystem._open_write, FakeFilesystem._open_write_update),
+        ('a', FakeFilesystem._open_append, FakeFilesystem._open_append_update),
+    )
+    for flags in ('', 't', 'b', '+', 't+', 'b+', '+t', '+b')
+}  # type: Dict[str, Tuple[Callable, bool]]
+
+
+class _StoreCallback(object):
+    """Stores written content as a file, cheaper than a closure per open()"""
+    __slots__ = ('fs', 'path', 'append')
+
+    def __init__(self, fs: FakeFilesystem, path: str, append: bool = False) -> None:
+        self.fs = fs
+        self.path = path
+        self.append = append
+
+    def __call__(self, content: bytes) -> None:
+        if self.append:
+            self.fs._append(self.path, content)
+        else:
+            self.fs._write(self.path, content)
 
 
 class FakedTemporaryDirectory(object):
-    def __enter__(self):
-        self.dirname = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))
+    def __init__(self, fs: FakeFilesystem) -> None:
+        self.fs = fs
+        self.dirname = None  # type: str
 
-        # No directory support in fakefs. Faking by adding a file
-        self.dummy_filepath = os.path.join(self.dirname, 'dummy_file')
-        with open(self.dummy_filepath, 'w'):
-            pass
+    def __enter__(self):
+        self.dirname = self.fs._temp_dir_name()
+        # Straight on the filesystem, no need to go through the patched functions
+        self.fs.makedirs(self.dirname)
         return self.dirname
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        os.remove(self.dummy_filepath)
+        self.fs.rmtree(self.dirname)
         self.dirname = None
-        self.dummy_filepath = None
@@ -1,139 +1,460 @@
 import unittest
 import fakefs
-from nose.tools import assert_equal, assert_true, assert_false, raises
 
+import builtins
 import os
 import shutil
+from stat import S_ISDIR
+import sys
 import tempfile
 
 
 class FakeTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Shared by all tests, the monkey patch targets are only built once
+        cls.fs = fakefs.FakeFilesystem()
+
+    def setUp(self):
+        self.fs.reset()
+        self.fs.monkey.start()
+
+    def tearDown(self):
+        self.fs.monkey.stop()
+
     def run(self, result=None):
-        self.fs = fakefs.FakeFilesystem()
+        # Just setUp, test, tearDown and cleanups, unittest's bookkeeping for
+        # subtests and the like is only overhead. Skipped and expected to fail
+        # tests are left to unittest itself.
+        test = getattr(self, self._testMethodName)
+        if (getattr(self.__class__, '__unittest_skip__', False)
+                or getattr(test, '__unittest_skip__', False)
+                or getattr(self, '__unittest_expecting_failure__', False)
+                or getattr(test, '__unittest_expecting_failure__', False)):
+            return super().run(result)
+
+        if result is None:
+            result = self.defaultTestResult()
+        result.startTest(self)
+        try:
+            success = self._run_part(result, self._run_test, test)
+            # doCleanups() would lose what a cleanup raises, as there is no
+            # unittest outcome to report it to
+            while self._cleanups:
+                function, args, kwargs = self._cleanups.pop()
+                success = self._run_part(result, function, *args, **kwargs) and success
+            if success:
+                result.addSuccess(self)
+        finally:
+            result.stopTest(self)
+        return result
+
+    def _run_test(self, test):
+        self.setUp()
+        try:
+            test()
+        finally:
+            self.tearDown()
+
+    def _run_part(self, result, function, *args, **kwargs):
+        """Calls function, reporting what it raises. True if it did not."""
+        try:
+            function(*args, **kwargs)
+        except unittest.SkipTest as e:
+            result.addSkip(self, str(e))
+        except self.failureException:
+            result.addFailure(self, sys.exc_info())
+        except Exception:
+            result.addError(self, sys.exc_info())
+        else:
+            return True
+        return False
+
+    def test_run_cleanups(self):
+        calls = []
+
+        class Inner(FakeTestCase):
+            def test(inner):
+                inner.addCleanup(calls.append, 'cleanup')
+
+        Inner.setUpClass()
+        result = Inner('test').run(unittest.TestResult())
+        assert result.wasSuccessful()
+        assert calls == ['cleanup']
+
+    def test_run_skip(self):
+        class Inner(FakeTestCase):
+            def test(inner):
+                inner.skipTest('reason')
+
+        Inner.setUpClass()
+        result = Inner('test').run(unittest.TestResult())
+        assert result.errors == []
+        assert [reason for _, reason in result.skipped] == ['reason']
+
+    def test_run_cleanup_error(self):
+        calls = []
+
+        def fail():
+            raise RuntimeError('cleanup')
+
+        class Inner(FakeTestCase):
+            def test(inner):
+                inner.addCleanup(calls.append, 'cleanup')
+                inner.addCleanup(fail)
+
+        Inner.setUpClass()
+        result = Inner('test').run(unittest.TestResult())
+        assert not result.wasSuccessful()
+        assert len(result.errors) == 1
+        assert calls == ['cleanup']
+
+    def test_run_skip_class(self):
+        @unittest.skip('reason')
+        class Inner(FakeTestCase):
+            def test(inner):
+                assert False
+
+        Inner.setUpClass()
+        result = Inner('test').run(unittest.TestResult())
+        assert result.failures == []
+        assert [reason for _, reason in result.skipped] == ['reason']
+
+    def test_run_expected_failure(self):
+        class Inner(FakeTestCase):
+            @unittest.expectedFailure
+            def test(inner):
+                assert False
+
+        Inner.setUpClass()
+        result = Inner('test').run(unittest.TestResult())
+        assert result.failures == []
+        assert len(result.expectedFailures) == 1
+
+    def test_reset(self):
+        self.fs.add_file('/dir/file', '')
+        os.mkdir('/empty')
+        self.fs.reset()
+        assert not os.path.isfile('/dir/file')
+        assert not os.path.isdir('/dir')
+        assert not os.path.isdir('/empty')
+
+    def test_monkey_nested(self):
         with self.fs.monkey.patch():
-            super(FakeTestCase, self).run(result)
-    
+            pass
+        assert builtins.open == self.fs.open
+        self.fs.monkey.stop()
+        assert builtins.open != self.fs.open
+        self.fs.monkey.start()
+
     def test_open_write_missing(self):
         with open('/a.txt', 'w') as f:
             f.write('abc')
-        assert_equal(b'abc', self.fs.content_for('/a.txt'))
+        assert b'abc' == self.fs.content_for('/a.txt')
     
     def test_open_write_existing(self):
         self.fs.add_file('/a.txt', 'original')
         with open('/a.txt', 'w') as f:
             f.write('abc')
-        assert_equal(b'abc', self.fs.content_for('/a.txt'))
+        assert b'abc' == self.fs.content_for('/a.txt')
     
     def test_open_read(self):
         self.fs.add_file('/x.txt', "xyz")
         with open('/x.txt') as f:
             data = f.read()
-        assert_equal("xyz", data)
+        assert "xyz" == data
 
-    @raises(FileNotFoundError)
-    def test_open_read_missing(self):
+    def test_open_read_encoding(self):
+        self.fs.add_file('/x.txt', '')
         with open('/x.txt') as f:
-            pass
+            assert f.encoding == 'utf-8'
+
+    def test_open_read_lines(self):
+        self.fs.add_file('/x.txt', 'a\nb\r\nc')
+        with open('/x.txt') as f:
+            lines = list(f)
+        assert ['a\n', 'b\n', 'c'] == lines
+
+    def test_open_read_binary(self):
+        self.fs.add_file('/x.bin', b'\x00\xff')
+        with open('/x.bin', 'rb') as f:
+            data = f.read()
+        assert b'\x00\xff' == data
+
+    def test_open_read_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            with open('/x.txt') as f:
+                pass
+
+    def test_open_write_tell(self):
+        with open('/a.txt', 'w') as f:
+            f.write('abc')
+            f.write('\u00e5')
+            assert f.tell() == 5
+            f.write('d')
+            assert f.tell() == 6
+            assert f.encoding == 'utf-8'
+        assert self.fs.content_for('/a.txt') == 'abc\u00e5d'.encode('utf-8')
+
+    def test_open_write_update_text(self):
+        with open('/a.txt', 'w+') as f:
+            f.write('abc\ndef')
+            assert f.tell() == 7
+            f.seek(0)
+            assert f.readline() == 'abc\n'
+            assert f.read() == 'def'
+        assert self.fs.content_for('/a.txt') == b'abc\ndef'
+
+    def test_open_write_binary_tell(self):
+        with open('/a.bin', 'wb') as f:
+            f.write(b'abc')
+            f.write(bytearray(b'de'))
+            assert f.tell() == 5
+        assert self.fs.content_for('/a.bin') == b'abcde'
+
+    def test_open_write_binary_int(self):
+        with open('/a.bin', 'wb') as f:
+            with self.assertRaises(TypeError):
+                f.write(3)
 
     def test_open_append_missing(self):
         with open('/a.txt', 'a') as f:
             f.write('abc')
-        assert_equal(b'abc', self.fs.content_for('/a.txt'))
+        assert b'abc' == self.fs.content_for('/a.txt')
 
     def test_open_append_existing(self):
         self.fs.add_file('/a.txt', 'abc')
         with open('/a.txt', 'a') as f:
             f.write('123')
-        assert_equal(b'abc123', self.fs.content_for('/a.txt'))
+        assert b'abc123' == self.fs.content_for('/a.txt')
+
+    def test_open_append_twice(self):
+        self.fs.add_file('/a.txt', 'abc')
+        with open('/a.txt', 'a') as f:
+            f.write('123')
+        with open('/a.txt', 'ab') as f:
+            f.write(b'456')
+        assert b'abc123456' == self.fs.content_for('/a.txt')
         
-    @raises(ValueError)
+    def test_arena_reclaimed(self):
+        data = b'x' * 101
+        for _ in range(3000):
+            for path in ('/a.log', '/b.log'):
+                with open(path, 'ab') as f:
+                    f.write(data)
+        big = b'y' * (1 << 20)
+        for _ in range(20):
+            with open('/big', 'wb') as f:
+                f.write(big)
+        assert self.fs.content_for('/a.log') == data * 3000
+        assert self.fs.content_for('/big') == big
+        assert len(self.fs._arena) < 4 * (1 << 20)
+
+    def test_open_read_update(self):
+        self.fs.add_file('/a.bin', b'abc')
+        with open('/a.bin', 'r+b') as f:
+            assert f.read(1) == b'a'
+            f.write(b'X')
+        assert self.fs.content_for('/a.bin') == b'aXc'
+
+    def test_open_read_update_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            open('/nope', 'r+')
+
+    def test_open_write_update(self):
+        self.fs.add_file('/a.bin', b'original')
+        with open('/a.bin', 'w+b') as f:
+            f.write(b'abc')
+            f.seek(0)
+            assert f.read() == b'abc'
+        assert self.fs.content_for('/a.bin') == b'abc'
+
+    def test_open_append_update(self):
+        self.fs.add_file('/a.txt', 'abc')
+        with open('/a.txt', 'a+') as f:
+            f.write('123')
+            f.seek(0)
+            assert f.read() == 'abc123'
+        assert self.fs.content_for('/a.txt') == b'abc123'
+
+    def test_arena_reclaimed_copy(self):
+        self.fs.add_file('/junk', 'J' * 10)
+        self.fs.add_file('/a', 'hello')
+        shutil.copy('/a', '/b')
+        os.remove('/junk')
+        with open('/big', 'wb') as f:
+            f.write(b'y' * (2 << 20))
+        assert self.fs.content_for('/a') == b'hello'
+        assert self.fs.content_for('/b') == b'hello'
+
+    def test_open_append_update_seek(self):
+        self.fs.add_file('/a.txt', 'abc')
+        with open('/a.txt', 'a+') as f:
+            f.seek(0)
+            assert f.read(1) == 'a'
+            f.write('X')
+        with open('/a.bin', 'a+b') as f:
+            f.write(b'abc')
+            f.seek(0)
+            f.write(b'X')
+        assert self.fs.content_for('/a.txt') == b'abcX'
+        assert self.fs.content_for('/a.bin') == b'abcX'
+
     def test_open_bad_mode(self):
-        with open('whatever', 'does not start with r, w, nor a'):
-            pass
+        with self.assertRaises(ValueError):
+            with open('whatever', 'does not start with r, w, nor a'):
+                pass
 
     def test_exists_missing(self):
-        assert_false(os.path.exists('/nope'))
+        assert not os.path.exists('/nope')
     
     def test_exists(self):
         self.fs.add_file('/yup', '')
-        assert_true(os.path.exists('/yup'))
+        assert os.path.exists('/yup')
+
+    def test_exists_dir(self):
+        self.fs.add_file('/dir/file', '')
+        os.mkdir('/empty')
+        assert os.path.exists('/dir')
+        assert os.path.exists('/empty')
 
-    @raises(FileNotFoundError)
     def test_getsize_missing(self):
-        os.path.getsize('/a')
+        with self.assertRaises(FileNotFoundError):
+            os.path.getsize('/a')
 
     def test_getsiz(self):
         self.fs.add_file('/a', '123')
-        assert_equal(os.path.getsize('/a'), 3)
+        assert os.path.getsize('/a') == 3
 
     def test_isdir_missing(self):
-        assert_false(os.path.isdir('/dir'))
+        assert not os.path.isdir('/dir')
 
     def test_isdir_file(self):
         self.fs.add_file('/file', '')
-        assert_false(os.path.isdir('/file'))
+        assert not os.path.isdir('/file')
 
     def test_isdir(self):
         self.fs.add_file('/dir/file', '')
-        assert_true(os.path.isdir('/dir'))
+        assert os.path.isdir('/dir')
+
+    def test_isdir_sibling_prefix(self):
+        self.fs.add_file('/foobar/file', '')
+        assert not os.path.isdir('/foo')
 
-    @raises(FileNotFoundError)
     def test_rename_missing(self):
-        os.rename('/nope', 'whatever')
+        with self.assertRaises(FileNotFoundError):
+            os.rename('/nope', 'whatever')
 
     def test_rename(self):
         self.fs.add_file('/before', '')
         os.rename('/before', '/after')
-        assert_true(os.path.isfile('/after'))
+        assert os.path.isfile('/after')
+
+    def test_rename_same(self):
+        self.fs.add_file('/d/x', '')
+        os.rename('/d/x', '/d/../d/x')
+        assert os.path.isfile('/d/x')
+        assert os.path.isdir('/d')
+        assert os.listdir('/') == ['d']
 
-    @raises(FileNotFoundError)
     def test_listdir_missing(self):
-        os.listdir('/nope')
+        with self.assertRaises(FileNotFoundError):
+            os.listdir('/nope')
 
     def test_listdir_empty(self):
         os.mkdir('/empty')
-        assert_equal(os.listdir('/empty'), [])
+        assert os.listdir('/empty') == []
+
+    def test_listdir_mkdir_twice(self):
+        os.mkdir('/dir')
+        os.makedirs('/dir', exist_ok=True)
+        assert os.listdir('/dir') == []
+
+    def test_listdir_mkdir_after_remove(self):
+        os.mkdir('/dir')
+        self.fs.add_file('/dir/file', '')
+        os.remove('/dir/file')
+        assert os.listdir('/dir') == []
+
+    def test_listdir_makedirs_parent(self):
+        os.makedirs('/m/n')
+        shutil.rmtree('/m/n')
+        assert os.listdir('/m') == []
 
     def test_listdir_single(self):
         self.fs.add_file('/single/file', '')
-        assert_equal(os.listdir('/single'), ['file'])
+        assert os.listdir('/single') == ['file']
+
+    def test_listdir_nested(self):
+        self.fs.add_file('/dir/sub/a', '')
+        self.fs.add_file('/dir/sub/b', '')
+        assert os.listdir('/dir') == ['sub']
+
+    def test_listdir_sibling_prefix(self):
+        self.fs.add_file('/foo/a', '')
+        self.fs.add_file('/foobar/b', '')
+        assert os.listdir('/foo') == ['a']
 
-    @raises(FileNotFoundError)
     def test_stat_missing(self):
-        os.stat('/nope')
+        with self.assertRaises(FileNotFoundError):
+            os.stat('/nope')
     
     def test_stat(self):
         self.fs.add_file('/file', '123')
         stat = os.stat('/file')
-        assert_equal(stat.st_mtime, 0)
+        assert stat.st_mtime == 0
+        assert stat.st_size == 3
+
+    def test_stat_dir(self):
+        self.fs.add_file('/dir/file', '')
+        assert S_ISDIR(os.stat('/dir').st_mode)
 
-    @raises(FileNotFoundError)
     def test_remove_missing(self):
-        os.remove('/nope')
+        with self.assertRaises(FileNotFoundError):
+            os.remove('/nope')
     
     def test_remove(self):
         self.fs.add_file('/file', '123')
         os.remove('/file')
-        assert_false(os.path.isfile('/file'))
+        assert not os.path.isfile('/file')
 
     # shutil
-    @raises(OSError)
     def test_copy_missing(self):
-        shutil.copy('/nope', 'whatever')
+        with self.assertRaises(OSError):
+            shutil.copy('/nope', 'whatever')
 
     def test_copy_old_still_there(self):
         self.fs.add_file('/a', 'a')
         shutil.copy('/a', '/b')
-        assert_true(os.path.isfile('/a'))
+        assert os.path.isfile('/a')
 
     def test_copy_new_content(self):
         self.fs.add_file('/a', 'a')
         shutil.copy('/a', '/b')
-        assert_equal(self.fs.content_for('/b'), b'a')
+        assert self.fs.content_for('/b') == b'a'
+
+    def test_copy_into_dir(self):
+        self.fs.add_file('/a', 'a')
+        os.mkdir('/dir')
+        assert shutil.copy('/a', '/dir') == '/dir/a'
+        assert self.fs.content_for('/dir/a') == b'a'
+
+    def test_copyfile(self):
+        self.fs.add_file('/a', 'a')
+        shutil.copyfile('/a', '/b')
+        assert self.fs.content_for('/b') == b'a'
+
+    def test_copy_then_append(self):
+        self.fs.add_file('/a', 'a')
+        shutil.copy('/a', '/b')
+        with open('/a', 'a') as f:
+            f.write('b')
+        assert self.fs.content_for('/a') == b'ab'
+        assert self.fs.content_for('/b') == b'a'
 
-    @raises(FileNotFoundError)
     def test_chown_missing(self):
-        shutil.chown('/nope', 'whatever')
+        with self.assertRaises(FileNotFoundError):
+            shutil.chown('/nope', 'whatever')
 
     def test_chown(self):
         self.fs.add_file('/file', '')
@@ -143,11 +464,26 @@ class FakeTestCase(unittest.TestCase):
     def test_rmtree(self):
         self.fs.add_file('/dir/dir/file', '')
         shutil.rmtree('/dir')
-        assert_false(os.path.isfile('/dir/dir/file'))
-        assert_false(os.path.isdir('/dir/dir'))
-        assert_false(os.path.isdir('/dir'))
+        assert not os.path.isfile('/dir/dir/file')
+        assert not os.path.isdir('/dir/dir')
+        assert not os.path.isdir('/dir')
+
+    def test_rmtree_sibling_prefix(self):
+        self.fs.add_file('/foo/a', '')
+        self.fs.add_file('/foobar/b', '')
+        shutil.rmtree('/foo')
+        assert not os.path.isdir('/foo')
+        assert os.path.isfile('/foobar/b')
 
     # tempfile
     def test_temporary_directory(self):
         with tempfile.TemporaryDirectory() as name:
-            assert_true(os.path.isdir(name))
+            assert os.path.isdir(name)
+
+    def test_temporary_directory_removed(self):
+        with tempfile.TemporaryDirectory() as name:
+            path = os.path.join(name, 'file')
+            with open(path, 'w') as f:
+                f.write('abc')
+        assert not os.path.isfile(path)
+        assert not os.path.isdir(name)